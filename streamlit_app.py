@@ -1,9 +1,18 @@
 import streamlit as st
-import requests
-import json
+import queue
+import re
+import sqlite3
+import threading
 import time
-from openai import OpenAI
-from pydantic import BaseModel
+import uuid
+from typing import Any
+from urllib.parse import urlsplit, urlunsplit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httpx
+import orjson
+import pandas as pd
+from openai import DefaultHttpxClient, OpenAI
+from pydantic import BaseModel, ConfigDict, TypeAdapter, field_validator
 
 # Page configuration
 st.set_page_config(
@@ -19,8 +28,10 @@ This application analyzes Lithuanian market products based on a technical specif
 It queries the OpenAI API to gather structured product information and evaluates each product.
 """)
 
-# Check if API key is configured
-if 'openai_api_key' not in st.secrets.get("config", {}):
+# Get the API key from secrets, stopping with setup instructions if it is not configured
+try:
+    OPENAI_API_KEY = st.secrets["config"]["openai_api_key"]
+except (KeyError, FileNotFoundError):
     st.error("""
     ⚠️ OpenAI API key not found in secrets.
 
@@ -34,8 +45,639 @@ if 'openai_api_key' not in st.secrets.get("config", {}):
     """)
     st.stop()
 
-# Get the API key from secrets
-OPENAI_API_KEY = st.secrets["config"]["openai_api_key"]
+# Identifier of this browser's search history, kept in the page URL
+if "history_id" not in st.query_params:
+    st.query_params["history_id"] = uuid.uuid4().hex
+history_owner = st.query_params["history_id"]
+
+
+# Function to get the shared OpenAI client, created once per API key
+@st.cache_resource
+def get_openai_client(api_key):
+    return OpenAI(
+        api_key=api_key,
+        timeout=httpx.Timeout(120.0, connect=5.0),
+        max_retries=2,
+        http_client=DefaultHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        )
+    )
+
+
+# Model used for web-search backed product research
+SEARCH_MODEL = "gpt-4o-search-preview"
+
+# Search history storage and paging
+HISTORY_DB_PATH = "search_history.db"
+HISTORY_PAGE_SIZE = 10
+HISTORY_MAX_SEARCHES = 200
+HISTORY_MAX_TOTAL_SEARCHES = 10000
+
+# Static options shared by every web-search request
+_SEARCH_REQUEST_OPTIONS = {"web_search_options": {}}
+
+# Prompt templates, built once at import time
+_URL_RETRIEVAL_PROMPT_TEMPLATE = """Analyze the Lithuanian market for {category} and gather detailed product information according to the following technical specification:
+{tech_spec}
+
+You must search in the following domains:
+    [
+{domains_list}
+    ]
+"""
+
+_URL_ANALYSIS_PROMPT_TEMPLATE = """Analyze the Lithuanian market for {category} and gather detailed product information according to the following technical specification:
+{tech_spec}
+{url_instruction}
+
+2. Verify the product is currently available for purchase
+3. Gather accurate pricing in EUR
+4. Evaluate technical specification requirements one by one
+"""
+
+# The templates are pre-split around their placeholders at import time
+_URL_RETRIEVAL_PROMPT_PARTS = tuple(
+    re.split(r"\{category\}|\{tech_spec\}|\{domains_list\}", _URL_RETRIEVAL_PROMPT_TEMPLATE))
+_URL_ANALYSIS_PROMPT_PARTS = tuple(
+    re.split(r"\{category\}|\{tech_spec\}|\{url_instruction\}", _URL_ANALYSIS_PROMPT_TEMPLATE))
+
+_PRODUCT_FORMAT_NOTE = """
+
+Results should be evaluated from all given domains.
+Return every matching product in the "products" array.
+"""
+
+# JSON schema of a product; strict mode needs nullable fields and name/value property pairs
+_PRODUCT_SCHEMA_PROPERTIES = {
+    "provider": {"type": ["string", "null"], "description": "Company selling the product"},
+    "provider_website": {"type": ["string", "null"], "description": "Main website domain (e.g., telia.lt)"},
+    "provider_url": {"type": ["string", "null"], "description": "Full URL to the specific product page"},
+    "product_name": {"type": "string", "description": "Complete product name with model"},
+    "product_properties": {
+        "type": "array",
+        "description": "Technical specifications of the product as name/value pairs",
+        "items": {
+            "type": "object",
+            "properties": {"name": {"type": "string"}, "value": {"type": "string"}},
+            "required": ["name", "value"],
+            "additionalProperties": False
+        }
+    },
+    "product_sku": {"type": ["string", "null"], "description": "Any product identifiers (SKU, UPC, model number)"},
+    "product_price": {"type": ["number", "null"], "description": "Current price in EUR"},
+    "evaluation": {
+        "type": ["string", "null"],
+        "description": "Detailed assessment of how the product meets or fails each technical specification"
+    },
+}
+
+PRICE_CALCULATION_OPTIONS = {
+    "none": "No special calculation (standard price)",
+    "unit": "Price per unit (e.g., per item)",
+    "kg": "Price per kilogram",
+    "liter": "Price per liter",
+    "package": "Price per package"
+}
+_PRICE_OPTION_KEYS = tuple(PRICE_CALCULATION_OPTIONS)
+
+_PRICE_CALC_UNIT_NAMES = {"kg": "kilogram", "liter": "liter", "package": "package"}
+
+# Analysis prompt step asking for the price per unit, prebuilt for fixed units
+_PRICE_CALC_STEP_TEMPLATE = "\n5. Calculate and include price per {} for each product"
+_PRICE_CALC_STEPS = {
+    objective: _PRICE_CALC_STEP_TEMPLATE.format(unit_name)
+    for objective, unit_name in _PRICE_CALC_UNIT_NAMES.items()
+}
+
+
+# Function to build the structured-output response format for product analysis
+def build_product_response_format(price_calc_objective, custom_unit=None):
+    properties = dict(_PRODUCT_SCHEMA_PROPERTIES)
+
+    # Add price calculation field based on objective
+    if price_calc_objective != "none":
+        if price_calc_objective == "unit":
+            unit_name = custom_unit if custom_unit else "unit"
+            properties["unit_type"] = {
+                "type": ["string", "null"],
+                "description": f"Unit used for the price, e.g. {unit_name}"
+            }
+        else:
+            unit_name = _PRICE_CALC_UNIT_NAMES[price_calc_objective]
+        properties[f"price_per_{price_calc_objective}"] = {
+            "type": ["number", "null"],
+            "description": f"Price in EUR per {unit_name}"
+        }
+
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "product_list",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "products": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": properties,
+                            "required": list(properties),
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["products"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+# Function to normalize a cited URL by dropping utm_* parameters and the fragment
+def _normalize_url(url):
+    parts = urlsplit(url.strip())
+    query = "&".join(param for param in parts.query.split("&") if not param.startswith("utm_"))
+    return urlunsplit(parts._replace(query=query, fragment=""))
+
+
+# Cached OpenAI call for URL retrieval; errors are raised so they are never cached
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _fetch_urls(prompt, model, _api_key):
+    client = get_openai_client(_api_key)
+
+    completion = client.chat.completions.create(
+        model=model,
+        **_SEARCH_REQUEST_OPTIONS,
+        messages=[
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+    )
+
+    # Extract URLs from annotations, deduplicated as a page is often cited several times
+    urls = {}
+    if hasattr(completion.choices[0].message, 'annotations'):
+        for annotation in completion.choices[0].message.annotations:
+            if hasattr(annotation, 'url_citation'):
+                url_data = annotation.url_citation.model_dump()
+                url = _normalize_url(url_data.get("url", ""))
+                if url and url not in urls:
+                    urls[url] = {
+                        "title": url_data.get("title", "No title"),
+                        "url": url
+                    }
+
+    return {
+        "content": completion.choices[0].message.content,
+        "urls": list(urls.values())
+    }
+
+
+# Cached OpenAI call for detailed product analysis, streamed to _on_delta
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _fetch_product_details(prompt, model, response_format, _api_key, _on_delta=None):
+    client = get_openai_client(_api_key)
+
+    stream = client.chat.completions.create(
+        model=model,
+        **_SEARCH_REQUEST_OPTIONS,
+        messages=[
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        response_format=response_format,
+        stream=True,
+    )
+
+    content_parts = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            content_parts.append(delta)
+            if _on_delta is not None:
+                _on_delta(delta)
+
+    return {
+        "content": "".join(content_parts)
+    }
+
+
+# Function to generate initial URL retrieval prompt
+def generate_url_retrieval_prompt(category, tech_spec, search_domains):
+    domains_list = "\n".join([f"        {i}:\"{domain}\"" for i, domain in enumerate(search_domains)])
+
+    head, after_category, after_spec, tail = _URL_RETRIEVAL_PROMPT_PARTS
+    return "".join((head, category, after_category, tech_spec, after_spec, domains_list, tail))
+
+
+# Function to generate detailed analysis prompt for a batch of URLs
+def generate_url_analysis_prompt(category, tech_spec, urls, price_calc_objective, custom_unit=None):
+    if len(urls) == 1:
+        url_instruction = f"You must search the following URL: {urls[0]}"
+    else:
+        urls_list = "\n".join([f"- {url}" for url in urls])
+        url_instruction = f"You must search each of the following URLs and include the products from all of them:\n{urls_list}"
+
+    # Price calculation step for the selected objective, if any
+    if price_calc_objective == "unit":
+        price_calc_step = _PRICE_CALC_STEP_TEMPLATE.format(custom_unit if custom_unit else "unit")
+    else:
+        price_calc_step = _PRICE_CALC_STEPS.get(price_calc_objective, "")
+
+    # Assemble the prompt in one join; the JSON shape is enforced by the response format
+    head, after_category, after_spec, tail = _URL_ANALYSIS_PROMPT_PARTS
+    return "".join((head, category, after_category, tech_spec, after_spec, url_instruction, tail,
+                    price_calc_step, _PRODUCT_FORMAT_NOTE))
+
+
+# Function to query OpenAI API for URL retrieval
+def query_openai_for_urls(prompt, api_key):
+    try:
+        return _fetch_urls(prompt, SEARCH_MODEL, api_key)
+    except Exception as e:
+        return {"error": f"API request failed: {str(e)}"}
+
+
+# Function to query OpenAI API for detailed product analysis
+def query_openai_for_product_details(prompt, api_key, response_format, on_delta=None):
+    try:
+        return _fetch_product_details(prompt, SEARCH_MODEL, response_format, api_key, on_delta)
+    except Exception as e:
+        return {"error": f"API request failed: {str(e)}"}
+
+
+# Structural characters that matter when scanning for balanced JSON
+_JSON_TOKEN_RE = re.compile(r'[\[\]{}"\\]')
+_JSON_OPENER_RE = re.compile(r'[\[{]')
+
+
+# Function to find the end of the balanced JSON value opening at content[start]
+def _balanced_end(content, start):
+    depth = 0
+    in_string = False
+    escaped_index = -1
+
+    for match in _JSON_TOKEN_RE.finditer(content, start):
+        index = match.start()
+        char = match.group()
+
+        if in_string:
+            if index == escaped_index:
+                continue
+            if char == "\\":
+                escaped_index = index + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+
+    return None
+
+
+# Function to yield every balanced JSON object or array in free text, trying each opener in turn
+def _balanced_candidates(content):
+    for match in _JSON_OPENER_RE.finditer(content):
+        end = _balanced_end(content, match.start())
+        if end is not None:
+            yield content[match.start():end]
+
+
+# A product as returned by the analysis prompt, with UI placeholders for missing fields
+class Product(BaseModel):
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+
+    provider: str = "N/A"
+    provider_website: str = "N/A"
+    provider_url: str = ""
+    product_name: str = "Unknown Product"
+    product_properties: dict[str, Any] = {}
+    product_sku: str = "N/A"
+    product_price: float | str = "N/A"
+    evaluation: str = "No evaluation available."
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _none_as_default(cls, value, info):
+        if value is None:
+            return cls.model_fields[info.field_name].get_default()
+        return value
+
+    # Structured outputs send properties as a list of name/value pairs
+    @field_validator("product_properties", mode="before")
+    @classmethod
+    def _properties_from_pairs(cls, value):
+        if isinstance(value, list):
+            return {item["name"]: item["value"] for item in value
+                    if isinstance(item, dict) and "name" in item and "value" in item}
+        return value
+
+    @property
+    def extras(self):
+        return self.model_extra or {}
+
+
+_PRODUCT_LIST_ADAPTER = TypeAdapter(list[Product])
+
+
+# Function to parse the product list from a model response
+def parse_products(content):
+    # The happy path is a response that is already valid JSON
+    try:
+        products_data = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        # Extract JSON embedded in text, skipping bracketed prose such as [1]
+        for json_str in _balanced_candidates(content):
+            try:
+                products_data = orjson.loads(json_str)
+            except orjson.JSONDecodeError:
+                continue
+            if isinstance(products_data, dict) and "products" in products_data:
+                break
+            if products_data and isinstance(products_data, list) and all(
+                    isinstance(item, dict) for item in products_data):
+                break
+        else:
+            raise ValueError("No JSON found in response")
+
+    # Check if the response is a list or contains a 'products' key
+    if isinstance(products_data, dict) and "products" in products_data:
+        products = products_data["products"]
+    else:
+        products = products_data
+
+    if not isinstance(products, list):
+        return []
+    return _PRODUCT_LIST_ADAPTER.validate_python(products)
+
+
+# Shared SQLite connection for the search history, created once per server process
+@st.cache_resource
+def get_history_db():
+    connection = sqlite3.connect(HISTORY_DB_PATH, check_same_thread=False)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS searches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            category TEXT,
+            tech_spec TEXT,
+            price_calc_objective TEXT
+        );
+        CREATE TABLE IF NOT EXISTS products (
+            search_id INTEGER NOT NULL REFERENCES searches (id),
+            position INTEGER NOT NULL,
+            product_json BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS products_search_id ON products (search_id);
+        CREATE INDEX IF NOT EXISTS searches_owner ON searches (owner, id);
+    """)
+    return connection, threading.Lock()
+
+
+# Function to store a search and its products in the owner's history
+def add_to_history(owner, category, tech_spec, price_calc_objective, products):
+    connection, lock = get_history_db()
+    with lock, connection:
+        cursor = connection.execute(
+            "INSERT INTO searches (owner, timestamp, category, tech_spec, price_calc_objective) VALUES (?, ?, ?, ?, ?)",
+            (owner, time.strftime("%Y-%m-%d %H:%M:%S"), category, tech_spec, price_calc_objective)
+        )
+        connection.executemany(
+            "INSERT INTO products (search_id, position, product_json) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, position, product.model_dump_json()) for position, product in enumerate(products)]
+        )
+
+        # Keep only the owner's most recent searches, like a ring buffer
+        newest_dropped = connection.execute(
+            "SELECT id FROM searches WHERE owner = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (owner, HISTORY_MAX_SEARCHES)
+        ).fetchone()
+        if newest_dropped:
+            connection.execute(
+                "DELETE FROM products WHERE search_id IN (SELECT id FROM searches WHERE owner = ? AND id <= ?)",
+                (owner, newest_dropped[0])
+            )
+            connection.execute("DELETE FROM searches WHERE owner = ? AND id <= ?", (owner, newest_dropped[0]))
+
+        # Also bound the whole database, so abandoned histories eventually expire
+        newest_dropped = connection.execute(
+            "SELECT id FROM searches ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (HISTORY_MAX_TOTAL_SEARCHES,)
+        ).fetchone()
+        if newest_dropped:
+            connection.execute("DELETE FROM products WHERE search_id <= ?", (newest_dropped[0],))
+            connection.execute("DELETE FROM searches WHERE id <= ?", (newest_dropped[0],))
+
+
+# Function to count the searches stored in the owner's history
+def count_history(owner):
+    connection, lock = get_history_db()
+    with lock:
+        return connection.execute("SELECT COUNT(*) FROM searches WHERE owner = ?", (owner,)).fetchone()[0]
+
+
+# Function to load a page of the owner's past searches, newest first
+def load_history(owner, offset, limit):
+    connection, lock = get_history_db()
+    with lock:
+        searches = pd.read_sql(
+            "SELECT id, timestamp, category, tech_spec, price_calc_objective, "
+            "(SELECT COUNT(*) FROM products WHERE search_id = searches.id) AS product_count "
+            "FROM searches WHERE owner = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            connection,
+            params=(owner, limit, offset)
+        )
+    return searches.to_dict("records")
+
+
+# Function to load the products found by a past search (cached, as stored searches never change)
+@st.cache_data(max_entries=64, show_spinner=False)
+def load_history_products(owner, search_id, price_calc_objective):
+    connection, lock = get_history_db()
+    with lock:
+        product_rows = connection.execute(
+            "SELECT product_json FROM products JOIN searches ON searches.id = products.search_id "
+            "WHERE products.search_id = ? AND searches.owner = ? ORDER BY position",
+            (search_id, owner)
+        ).fetchall()
+    product_jsons = [product_json for product_json, in product_rows]
+
+    products_df = pd.DataFrame([
+        {
+            "#": j + 1,
+            "Product": product.product_name,
+            "Price": f"€{product.product_price}",
+            "Price per Unit": _price_per_text(product, price_calc_objective),
+            "Provider": product.provider,
+            "URL": product.provider_url or None,
+        }
+        for j, product in enumerate(map(Product.model_validate_json, product_jsons))
+    ])
+    if price_calc_objective == "none":
+        products_df = products_df.drop(columns="Price per Unit", errors="ignore")
+
+    return products_df, product_jsons
+
+
+# Unit suffixes shown after a price per unit, e.g. "€1.5/kg"
+_UNIT_SUFFIX = {"kg": "/kg", "liter": "/L", "package": "/pkg"}
+
+
+# Function to get the unit suffix for a product's price per unit
+def _unit_suffix(price_calc_objective, product):
+    if price_calc_objective == "unit":
+        unit_type = product.extras.get("unit_type")
+        return f"/{unit_type}" if unit_type is not None else ""
+    return _UNIT_SUFFIX.get(price_calc_objective, "")
+
+
+# Function to render a single product as an expandable card
+def render_product(i, product, price_calc_objective):
+    product_title = f"{i + 1}. {product.product_name} - €{product.product_price}"
+
+    # Add price calculation to title if available
+    price_per_text = _price_per_text(product, price_calc_objective)
+    if price_per_text:
+        product_title += f" ({price_per_text})"
+
+    with st.expander(product_title):
+        col1, col2 = st.columns([1, 2])
+
+        with col1:
+            # Product details are emitted as a single markdown element
+            details = [
+                f"**Provider:** {product.provider}",
+                f"**Website:** {product.provider_website}",
+            ]
+            if product.provider_url:
+                details.append(f"**Product Link:** [View Product]({product.provider_url})")
+            details.append(f"**SKU/ID:** {product.product_sku}")
+            details.append(f"**Price:** €{product.product_price}")
+
+            # Display price calculation if available
+            if price_per_text:
+                details.append(f"**Price per {price_calc_objective.capitalize()}:** {price_per_text}")
+
+            st.markdown("\n\n".join(details))
+
+        with col2:
+            # Properties and evaluation, headings included, are one markdown element too
+            sections = ["### Product Properties"]
+            properties = product.product_properties
+            if properties:
+                sections.extend(f"**{key}:** {value}" for key, value in properties.items())
+            else:
+                sections.append("No detailed properties available.")
+
+            sections.append("### Technical Evaluation")
+            sections.append(product.evaluation)
+            st.markdown("\n\n".join(sections))
+
+
+# Function to format a product's price per selected unit, e.g. "€1.5/kg"
+def _price_per_text(product, price_calc_objective):
+    if price_calc_objective == "none":
+        return ""
+
+    price_per = product.extras.get(f"price_per_{price_calc_objective}")
+    if price_per is None:
+        return ""
+
+    return f"€{price_per}{_unit_suffix(price_calc_objective, product)}"
+
+
+# Function to render the search history as a fragment, so paging reruns only this function
+@st.fragment
+def render_history(owner):
+    history_count = count_history(owner)
+    if not history_count:
+        st.info("No search history yet. Search for products to see your history here.")
+        return
+
+    # Only the entries of the selected page are loaded on each rerun
+    page_count = (history_count + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    page = 0
+    if page_count > 1:
+        page = st.selectbox(
+            "Page",
+            options=range(page_count),
+            format_func=lambda p: f"{p + 1} of {page_count}"
+        )
+    page_entries = load_history(owner, page * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE)
+
+    searches_df = pd.DataFrame([
+        {
+            "Time": entry["timestamp"],
+            "Category": entry["category"],
+            "Search Query": entry["tech_spec"],
+            "Price Calculation": (f"Price per {entry['price_calc_objective']}"
+                                  if entry["price_calc_objective"] != "none" else ""),
+            "Products": entry["product_count"],
+        }
+        for entry in page_entries
+    ])
+    search_selection = st.dataframe(
+        searches_df,
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"history_searches_{page}"
+    )
+
+    if not search_selection.selection.rows:
+        st.info("Select a search to see the products it found.")
+        return
+
+    entry = page_entries[search_selection.selection.rows[0]]
+    products_df, product_jsons = load_history_products(owner, entry["id"], entry["price_calc_objective"])
+    st.markdown(f"**Results:** {len(product_jsons)} products found")
+
+    product_selection = st.dataframe(
+        products_df,
+        hide_index=True,
+        column_config={"URL": st.column_config.LinkColumn("URL", display_text="View Product")},
+        on_select="rerun",
+        selection_mode="single-row",
+        key=f"history_products_{entry['id']}"
+    )
+
+    # Full details of the selected product are sent as a single JSON element
+    if product_selection.selection.rows:
+        st.json(product_jsons[product_selection.selection.rows[0]])
+
+
+# Sidebar settings
+st.sidebar.header("Settings")
+max_parallel_requests = st.sidebar.number_input(
+    "Parallel API requests:",
+    min_value=1,
+    max_value=16,
+    value=4,
+    help="Maximum number of product-analysis requests sent to OpenAI at the same time. "
+         "Lower it if you hit API rate limits."
+)
+force_refresh = st.sidebar.checkbox(
+    "Force refresh",
+    help="Ignore cached API responses and query OpenAI again on the next search."
+)
+show_prompts = st.sidebar.checkbox(
+    "Show prompts",
+    help="Debugging aid: display the URL retrieval prompt with the search results."
+)
 
 # Create tabs for different sections
 tab1, tab2, tab3 = st.tabs(["Product Search", "Search History", "About"])
@@ -50,18 +692,10 @@ with tab1:
         placeholder="Example: Smartphones, Laptops, Vitamins, Sports shoes, Furniture"
     )
 
-    # Technical specification input
-    st.subheader("Enter Technical Specification")
-    tech_spec = st.text_area(
-        "Technical specifications for the product you're looking for:",
-        height=200,
-        placeholder="Example: Smartphone with at least 6GB RAM, 128GB storage, 6.1 inch OLED display, 5G connectivity, IP68 water resistance"
-    )
-
 
     # Function to discover top Lithuanian domains for a product category
     def discover_lithuanian_domains(category, api_key):
-        client = OpenAI(api_key=api_key)
+        client = get_openai_client(api_key)
 
         prompt = f"""Find the top 10 Lithuanian e-commerce or retail websites that would sell products in the category: "{category}".
 
@@ -113,6 +747,7 @@ with tab1:
 
                 if discovered_domains:
                     st.session_state.search_domains = discovered_domains
+                    st.session_state.active_domains = list(discovered_domains)
                     st.session_state.last_category = product_category
                     st.success(f"Found {len(discovered_domains)} relevant Lithuanian domains for {product_category}")
                 else:
@@ -127,534 +762,293 @@ with tab1:
                         "1a.lt"
                     ]
                     st.session_state.search_domains = fallback_domains
+                    st.session_state.active_domains = list(fallback_domains)
+                    st.session_state.last_category = product_category
                     st.warning("Could not discover specific domains. Using general Lithuanian e-commerce sites.")
         else:
             # Initial state - empty list until category is provided
             st.session_state.search_domains = []
+            st.session_state.active_domains = []
             st.info("Enter a product category above to discover relevant Lithuanian websites.")
 
-    # Input for adding new domain
-    col1, col2 = st.columns([3, 1])
-    with col1:
-        new_domain = st.text_input("Add new domain (e.g., example.lt):",
-                                   placeholder="Enter a Lithuanian domain")
-    with col2:
-        if st.button("Add Domain") and new_domain:
-            if "search_domains" not in st.session_state:
-                st.session_state.search_domains = []
-
-            if new_domain not in st.session_state.search_domains:
-                st.session_state.search_domains.append(new_domain)
-                st.success(f"Added {new_domain} to search domains")
-            else:
-                st.info(f"{new_domain} is already in search domains")
-
-    # Display and manage current domains
-    if "search_domains" in st.session_state and st.session_state.search_domains:
-        st.write("Current search domains:")
-        domains_to_remove = []
-
-        # Display domains in multi-columns for better UI
-        domain_cols = st.columns(3)
-        for i, domain in enumerate(st.session_state.search_domains):
-            col_idx = i % 3
-            with domain_cols[col_idx]:
-                if st.checkbox(domain, value=True, key=f"domain_{domain}"):
-                    pass  # Keep domain if checked
+    # Function to render the domain management controls as a fragment
+    @st.fragment
+    def render_domain_controls(product_category):
+        # Input for adding new domain
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            new_domain = st.text_input("Add new domain (e.g., example.lt):",
+                                       placeholder="Enter a Lithuanian domain")
+        with col2:
+            if st.button("Add Domain") and new_domain:
+                if "search_domains" not in st.session_state:
+                    st.session_state.search_domains = []
+
+                if new_domain not in st.session_state.search_domains:
+                    st.session_state.search_domains.append(new_domain)
+                    st.session_state.active_domains = st.session_state.get("active_domains", []) + [new_domain]
+                    st.success(f"Added {new_domain} to search domains")
                 else:
-                    domains_to_remove.append(domain)
-
-        # Remove unchecked domains
-        for domain in domains_to_remove:
-            if domain in st.session_state.search_domains:
-                st.session_state.search_domains.remove(domain)
-
-        # Refresh domains button
-        if st.button("Refresh Domains for This Category"):
-            if product_category:
-                del st.session_state.search_domains
-                del st.session_state.last_category
-                st.experimental_rerun()
-    else:
-        st.info("No search domains yet. Enter a product category to discover relevant domains.")
-
-    # NEW FEATURE: Price Calculation Objective
-    st.subheader("Price Calculation Objective")
-
-    price_calculation_options = {
-        "none": "No special calculation (standard price)",
-        "unit": "Price per unit (e.g., per item)",
-        "kg": "Price per kilogram",
-        "liter": "Price per liter",
-        "package": "Price per package"
-    }
-
-    price_calc_objective = st.selectbox(
-        "Select how you want prices to be calculated:",
-        options=list(price_calculation_options.keys()),
-        format_func=lambda x: price_calculation_options[x]
-    )
-
-    # Additional input for custom calculation if needed
-    custom_calc_unit = None
-    if price_calc_objective != "none":
-        st.info(f"Products will be evaluated based on {price_calculation_options[price_calc_objective]}")
-
-        if price_calc_objective == "unit":
-            custom_calc_unit = st.text_input(
-                "Specify unit type (e.g., tablet, pill, piece):",
-                placeholder="Leave empty for generic 'unit'"
+                    st.info(f"{new_domain} is already in search domains")
+
+        # Display and manage current domains
+        if "search_domains" in st.session_state and st.session_state.search_domains:
+            # A single multiselect picks the active domains; the full list stays intact
+            st.multiselect(
+                "Current search domains:",
+                options=st.session_state.search_domains,
+                key="active_domains"
             )
 
-
-    # Function to generate initial URL retrieval prompt
-    def generate_url_retrieval_prompt(category, tech_spec, search_domains):
-        domains_list = "\n".join([f"        {i}:\"{domain}\"" for i, domain in enumerate(search_domains)])
-
-        prompt = f"""Analyze the Lithuanian market for {category} and gather detailed product information according to the following technical specification:
-{tech_spec}
-
-You must search in the following domains:
-    [
-{domains_list}
-    ]
-"""
-        return prompt
-
-
-    # Function to generate detailed analysis prompt for each URL
-    def generate_url_analysis_prompt(category, tech_spec, url, price_calc_objective, custom_unit=None):
-        # Base prompt
-        prompt = f"""Analyze the Lithuanian market for {category} and gather detailed product information according to the following technical specification:
-{tech_spec}
-You must search the following URL: {url}
-
-2. Verify the product is currently available for purchase
-3. Gather accurate pricing in EUR
-4. Evaluate technical specification requirements one by one
-"""
-
-        # Add price calculation objective if selected
-        if price_calc_objective != "none":
-            if price_calc_objective == "unit":
-                unit_type = custom_unit if custom_unit else "unit"
-                prompt += f"\n5. Calculate and include price per {unit_type} for each product"
-            elif price_calc_objective == "kg":
-                prompt += "\n5. Calculate and include price per kilogram for each product"
-            elif price_calc_objective == "liter":
-                prompt += "\n5. Calculate and include price per liter for each product"
-            elif price_calc_objective == "package":
-                prompt += "\n5. Calculate and include price per package for each product"
-
-        # JSON format instructions
-        prompt += """
-
-Results should be evaluated from all given domains.
-IMPORTANT: Your response MUST be formatted EXACTLY as a valid JSON array of product objects.
-Each product in the array should have the following fields:
-
-[
-  {
-    "provider": "Company selling the product",
-    "provider_website": "Main website domain (e.g., telia.lt)",
-    "provider_url": "Full URL to the specific product page",
-    "product_name": "Complete product name with model",
-    "product_properties": {
-      "key_spec1": "value1",
-      "key_spec2": "value2"
-    },
-    "product_sku": "Any product identifiers (SKU, UPC, model number)",
-    "product_price": 299.99,"""
-
-        # Add price calculation field based on objective
-        if price_calc_objective != "none":
-            if price_calc_objective == "unit":
-                unit_type = custom_unit if custom_unit else "unit"
-                prompt += f"""
-    "price_per_{price_calc_objective}": 9.99,
-    "unit_type": "{unit_type}","""
-            else:
-                prompt += f"""
-    "price_per_{price_calc_objective}": 9.99,"""
-
-        # Complete the prompt
-        prompt += """
-    "evaluation": "Detailed assessment of how the product meets or fails each technical specification"
-  }
-]
-
-DO NOT include any explanation, preamble, or additional text - ONLY provide the JSON array.
-"""
-        return prompt
-
-
-    # Function to query OpenAI API for URL retrieval
-    def query_openai_for_urls(prompt, api_key):
-        client = OpenAI(api_key=api_key)
-
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4o-search-preview",
-                web_search_options={},
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-            )
-
-            # Extract URLs from annotations
-            urls = []
-            if hasattr(completion.choices[0].message, 'annotations'):
-                for annotation in completion.choices[0].message.annotations:
-                    if hasattr(annotation, 'url_citation'):
-                        url_data = annotation.url_citation.model_dump()
-                        urls.append({
-                            "title": url_data.get("title", "No title"),
-                            "url": url_data.get("url", "")
-                        })
-
-            return {
-                "content": completion.choices[0].message.content,
-                "urls": urls
-            }
-
-        except Exception as e:
-            return {"error": f"API request failed: {str(e)}"}
-
-
-    # Function to query OpenAI API for detailed product analysis
-    def query_openai_for_product_details(prompt, api_key):
-        client = OpenAI(api_key=api_key)
-
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4o-search-preview",
-                web_search_options={},
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-            )
-
-            return {
-                "content": completion.choices[0].message.content
-            }
-
-        except Exception as e:
-            return {"error": f"API request failed: {str(e)}"}
-
-
-    # Function to parse and display results
-    def display_results(all_products, category, price_calc_objective):
+            # Refresh domains button; discovery needs a full app rerun
+            if st.button("Refresh Domains for This Category", disabled=not product_category):
+                st.session_state.pop("last_category", None)
+                st.rerun()
+        else:
+            st.info("No search domains yet. Enter a product category to discover relevant domains.")
+
+
+    render_domain_controls(product_category)
+
+    # The search inputs live in a form, so editing them does not rerun the app
+    with st.form("search_form", border=False):
+        # Technical specification input
+        st.subheader("Enter Technical Specification")
+        tech_spec = st.text_area(
+            "Technical specifications for the product you're looking for:",
+            height=200,
+            placeholder="Example: Smartphone with at least 6GB RAM, 128GB storage, 6.1 inch OLED display, 5G connectivity, IP68 water resistance"
+        )
+
+        # NEW FEATURE: Price Calculation Objective
+        st.subheader("Price Calculation Objective")
+
+        price_calc_objective = st.selectbox(
+            "Select how you want prices to be calculated:",
+            options=_PRICE_OPTION_KEYS,
+            format_func=PRICE_CALCULATION_OPTIONS.__getitem__
+        )
+
+        # Form widgets cannot react to unsubmitted values, so the unit type is always shown
+        custom_calc_unit = st.text_input(
+            "Unit type for price per unit (e.g., tablet, pill, piece):",
+            placeholder="Leave empty for generic 'unit'"
+        )
+
+        # Analysis batching: several URLs can be packed into one API request
+        st.subheader("Analysis Batching")
+        urls_per_request = st.slider(
+            "URLs analyzed per API request:",
+            min_value=1,
+            max_value=10,
+            value=1,
+            help="Packing several URLs into one request sends the shared instructions once and saves round-trips, "
+                 "at the cost of longer individual responses."
+        )
+
+        search_submitted = st.form_submit_button("Search Products", type="primary", disabled=not product_category)
+
+
+    # Function to finish the results of a search once all products are in
+    def display_results(all_products, category, price_calc_objective, results_header):
         if not all_products:
-            st.error("No products found or error occurred during analysis.")
+            results_header.error("No products found matching your specifications.")
             return
 
         # Display the products
-        st.subheader(f"Found {len(all_products)} Products in {category} category")
-
-        # Save to session state history
-        if "search_history" not in st.session_state:
-            st.session_state.search_history = []
-
-        history_entry = {
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "category": category,
-            "tech_spec": tech_spec,
-            "price_calc_objective": price_calc_objective,
-            "results": all_products
-        }
-        st.session_state.search_history.append(history_entry)
-
-        # Display results in expandable sections
-        for i, product in enumerate(all_products):
-            product_title = f"{i + 1}. {product.get('product_name', 'Unknown Product')} - €{product.get('product_price', 'N/A')}"
-
-            # Add price calculation to title if available
-            if price_calc_objective != "none":
-                price_per_key = f"price_per_{price_calc_objective}"
-                if price_per_key in product:
-                    unit_display = ""
-                    if price_calc_objective == "unit" and "unit_type" in product:
-                        unit_display = f"/{product['unit_type']}"
-                    elif price_calc_objective == "kg":
-                        unit_display = "/kg"
-                    elif price_calc_objective == "liter":
-                        unit_display = "/L"
-                    elif price_calc_objective == "package":
-                        unit_display = "/pkg"
-
-                    product_title += f" (€{product.get(price_per_key, 'N/A')}{unit_display})"
-
-            with st.expander(product_title):
-                col1, col2 = st.columns([1, 2])
-
-                with col1:
-                    st.markdown(f"**Provider:** {product.get('provider', 'N/A')}")
-                    st.markdown(f"**Website:** {product.get('provider_website', 'N/A')}")
-                    if 'provider_url' in product and product['provider_url']:
-                        st.markdown(f"**Product Link:** [View Product]({product['provider_url']})")
-                    st.markdown(f"**SKU/ID:** {product.get('product_sku', 'N/A')}")
-                    st.markdown(f"**Price:** €{product.get('product_price', 'N/A')}")
-
-                    # Display price calculation if available
-                    if price_calc_objective != "none":
-                        price_per_key = f"price_per_{price_calc_objective}"
-                        if price_per_key in product:
-                            unit_display = ""
-                            if price_calc_objective == "unit" and "unit_type" in product:
-                                unit_display = f"/{product['unit_type']}"
-                            elif price_calc_objective == "kg":
-                                unit_display = "/kg"
-                            elif price_calc_objective == "liter":
-                                unit_display = "/L"
-                            elif price_calc_objective == "package":
-                                unit_display = "/pkg"
-
-                            st.markdown(
-                                f"**Price per {price_calc_objective.capitalize()}:** €{product.get(price_per_key, 'N/A')}{unit_display}")
-
-                with col2:
-                    st.subheader("Product Properties")
-                    properties = product.get('product_properties', {})
-                    if properties:
-                        for key, value in properties.items():
-                            st.markdown(f"**{key}:** {value}")
-                    else:
-                        st.write("No detailed properties available.")
+        results_header.subheader(f"Found {len(all_products)} Products in {category} category")
 
-                    st.subheader("Technical Evaluation")
-                    evaluation = product.get('evaluation', 'No evaluation available.')
-                    st.write(evaluation)
+        # Save the search to this browser's history in the SQLite database
+        add_to_history(history_owner, category, tech_spec, price_calc_objective, all_products)
 
         # Show raw JSON option
         with st.expander("View Raw JSON Response"):
-            st.json(all_products)
+            st.json([product.model_dump() for product in all_products])
 
 
     # Search button
-    if st.button("Search Products", type="primary", disabled=not (tech_spec and product_category)):
-        # Warn if no category is provided
+    if search_submitted:
+        # Warn if no category or technical specification is provided
         if not product_category:
             st.warning("Please enter a product category to continue.")
             st.stop()
+        if not tech_spec:
+            st.warning("Please enter a technical specification to continue.")
+            st.stop()
 
-        with st.spinner(f"Analyzing Lithuanian market for {product_category}... (this may take 1-2 minutes)"):
-            # Get active search domains
-            if "search_domains" not in st.session_state or not st.session_state.search_domains:
-                st.warning("No search domains available. Please enter a product category first.")
-                st.stop()
+        # Get active search domains
+        if "search_domains" not in st.session_state or not st.session_state.search_domains:
+            st.warning("No search domains available. Please enter a product category first.")
+            st.stop()
 
-            active_domains = [domain for domain in st.session_state.search_domains
-                              if st.session_state.get(f"domain_{domain}", True)]
+        active_domains = st.session_state.get("active_domains", [])
 
-            if not active_domains:
-                st.warning("No search domains selected. Please select at least one domain.")
-                st.stop()
+        if not active_domains:
+            st.warning("No search domains selected. Please select at least one domain.")
+            st.stop()
 
-            # LAYER 1: Generate prompt for URL retrieval
-            url_retrieval_prompt = generate_url_retrieval_prompt(product_category, tech_spec, active_domains)
+        # Confirm the price calculation, chosen in the form, once it is submitted
+        if price_calc_objective != "none":
+            st.info(f"Products will be evaluated based on {PRICE_CALCULATION_OPTIONS[price_calc_objective]}")
 
-            # Show prompt in expandable section
+        # Drop cached API responses if the user asked for fresh results
+        if force_refresh:
+            _fetch_urls.clear()
+            _fetch_product_details.clear()
+
+        # LAYER 1: Generate prompt for URL retrieval
+        url_retrieval_prompt = generate_url_retrieval_prompt(product_category, tech_spec, active_domains)
+
+        # Show prompt in expandable section when debugging
+        if show_prompts:
             with st.expander("View URL Retrieval Prompt"):
                 st.text(url_retrieval_prompt)
 
-            # Query OpenAI for URLs
-            url_response = query_openai_for_urls(url_retrieval_prompt, OPENAI_API_KEY)
+        # Progress of the search is reported in a single status container
+        search_status = st.status(
+            f"Analyzing Lithuanian market for {product_category}... (this may take 1-2 minutes)",
+            expanded=True
+        )
 
-            if "error" in url_response:
-                st.error(f"Error in URL retrieval: {url_response['error']}")
-                st.stop()
+        # Query OpenAI for URLs
+        url_response = query_openai_for_urls(url_retrieval_prompt, OPENAI_API_KEY)
 
-            # Display found URLs
-            with st.expander("Found URLs for Analysis"):
-                st.write(f"Found {len(url_response['urls'])} relevant URLs")
-                for i, url_data in enumerate(url_response['urls']):
-                    st.write(f"{i + 1}. [{url_data['title']}]({url_data['url']})")
+        if "error" in url_response:
+            search_status.update(label="URL retrieval failed", state="error")
+            st.error(f"Error in URL retrieval: {url_response['error']}")
+            st.stop()
 
-            # LAYER 2: Analyze each URL for detailed product information
-            all_products = []
+        # Display found URLs
+        search_status.markdown(
+            f"Found {len(url_response['urls'])} relevant URLs:\n\n" +
+            "\n".join(f"{i + 1}. [{url_data['title']}]({url_data['url']})"
+                      for i, url_data in enumerate(url_response['urls']))
+        )
+
+        # Nothing to analyze without URLs, so skip the analysis step entirely
+        if not url_response['urls']:
+            search_status.update(label="No product pages found", state="error")
+            st.warning("No URLs were found on the selected domains. Try other domains or a broader specification.")
+            st.stop()
 
-            progress_bar = st.progress(0)
-            status_text = st.empty()
+        # LAYER 2: Analyze the URLs in batches for detailed product information
+        all_products = []
 
-            for i, url_data in enumerate(url_response['urls']):
-                status_text.text(f"Analyzing URL {i + 1}/{len(url_response['urls'])}: {url_data['title']}")
+        found_urls = url_response['urls']
+        url_batches = [found_urls[start:start + urls_per_request]
+                       for start in range(0, len(found_urls), urls_per_request)]
 
-                # Generate analysis prompt for this URL
-                analysis_prompt = generate_url_analysis_prompt(
-                    product_category,
-                    tech_spec,
-                    url_data['url'],
-                    price_calc_objective,
-                    custom_calc_unit
-                )
+        progress_bar = search_status.progress(0)
 
-                # Query OpenAI for detailed product analysis
-                product_response = query_openai_for_product_details(analysis_prompt, OPENAI_API_KEY)
+        # Generate one analysis prompt per batch of URLs
+        analysis_jobs = []
+        analyzed_count = 0
+        for batch in url_batches:
+            first_index = analyzed_count + 1
+            analyzed_count += len(batch)
+            if len(batch) == 1:
+                batch_label = f"URL {first_index}"
+            else:
+                batch_label = f"URLs {first_index}-{analyzed_count}"
+
+            analysis_prompt = generate_url_analysis_prompt(
+                product_category,
+                tech_spec,
+                [url_data['url'] for url_data in batch],
+                price_calc_objective,
+                custom_calc_unit
+            )
+            analysis_jobs.append((batch_label, analysis_prompt))
 
-                if "error" not in product_response:
-                    try:
-                        # Try to parse JSON from response
-                        product_content = product_response["content"]
+        search_status.update(label=f"Analyzing {len(found_urls)} URLs in {len(analysis_jobs)} requests...")
 
-                        # Extract JSON if it's embedded in text
-                        import re
+        # Structured output format shared by all analysis requests of this search
+        product_response_format = build_product_response_format(price_calc_objective, custom_calc_unit)
 
-                        json_match = re.search(r'(\[\s*{.*}\s*\]|\{\s*"products"\s*:\s*\[.*\]\s*\})', product_content,
-                                               re.DOTALL)
+        # Query OpenAI for detailed product analysis with several requests in flight
+        results_header = st.empty()
 
-                        if json_match:
-                            json_str = json_match.group(0)
-                            products_data = json.loads(json_str)
-                        else:
-                            products_data = json.loads(product_content)
+        # Streamed output is passed to the main thread through a queue
+        stream_queue = queue.Queue()
+        streamed_text = {}
+        live_output = search_status.empty()
+        analysis_warnings = []
 
-                        # Check if the response is a list or contains a 'products' key
-                        if isinstance(products_data, dict) and "products" in products_data:
-                            products = products_data["products"]
-                        else:
-                            products = products_data
+        executor = ThreadPoolExecutor(max_workers=max_parallel_requests)
+        try:
+            futures = {
+                executor.submit(
+                    query_openai_for_product_details,
+                    analysis_prompt,
+                    OPENAI_API_KEY,
+                    product_response_format,
+                    lambda delta, job_index=job_index: stream_queue.put((job_index, delta))
+                ): job_index
+                for job_index, (_, analysis_prompt) in enumerate(analysis_jobs)
+            }
 
-                        if isinstance(products, list):
-                            all_products.extend(products)
+            pending = set(futures)
+            completed_count = 0
+            while pending:
+                done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
 
-                    except Exception as e:
-                        st.warning(f"Could not parse products from URL {i + 1}: {str(e)}")
-                else:
-                    st.warning(f"Error analyzing URL {i + 1}: {product_response['error']}")
+                # Show the most recently streamed output while requests are in flight
+                latest_job = None
+                while True:
+                    try:
+                        job_index, delta = stream_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    streamed_text[job_index] = streamed_text.get(job_index, "") + delta
+                    latest_job = job_index
+                if latest_job is not None:
+                    live_output.code(streamed_text[latest_job][-1500:], language="json")
+
+                for future in done:
+                    completed_count += 1
+                    job_index = futures[future]
+                    batch_label = analysis_jobs[job_index][0]
+                    product_response = future.result()
+
+                    if "error" not in product_response:
+                        try:
+                            # Try to parse JSON from response
+                            products = parse_products(product_response["content"])
+                        except Exception as e:
+                            analysis_warnings.append(f"Could not parse products from {batch_label}: {str(e)}")
+                        else:
+                            for product in products:
+                                render_product(len(all_products), product, price_calc_objective)
+                                all_products.append(product)
+                            results_header.subheader(f"Found {len(all_products)} Products so far...")
+                    else:
+                        analysis_warnings.append(f"Error analyzing {batch_label}: {product_response['error']}")
 
-                # Update progress
-                progress_value = (i + 1) / len(url_response['urls'])
-                progress_bar.progress(progress_value)
+                    # Update progress
+                    search_status.update(label=f"Analyzed {completed_count}/{len(analysis_jobs)} requests ({batch_label})")
+                    progress_bar.progress(completed_count / len(analysis_jobs))
+        finally:
+            # Drop queued requests if the search is interrupted by a rerun or stop
+            executor.shutdown(wait=False, cancel_futures=True)
 
-            status_text.text("Analysis complete!")
+        live_output.empty()
 
-            # Display all results
-            if all_products:
-                display_results(all_products, product_category, price_calc_objective)
-            else:
-                st.error("No products found matching your specifications.")
+        for warning in analysis_warnings:
+            search_status.warning(warning)
+        # Collapse the status once done unless it holds warnings worth reading
+        search_status.update(label="Analysis complete!", state="complete", expanded=bool(analysis_warnings))
+
+        # Finish the results below the product cards
+        display_results(all_products, product_category, price_calc_objective, results_header)
 
 with tab2:
     st.header("Search History")
-
-    if "search_history" not in st.session_state or not st.session_state.search_history:
-        st.info("No search history yet. Search for products to see your history here.")
-    else:
-        for i, entry in enumerate(reversed(st.session_state.search_history)):
-            # Add category and price calculation info to history entry title
-            category_info = f"[{entry.get('category', 'Unknown')}]"
-            price_calc_info = ""
-            if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                price_calc_info = f" (Price per {entry['price_calc_objective']})"
-
-            with st.expander(f"{entry['timestamp']} - {category_info} {entry['tech_spec'][:50]}...{price_calc_info}"):
-                st.markdown(f"**Category:** {entry.get('category', 'None')}")
-                st.markdown(f"**Search Query:**\n{entry['tech_spec']}")
-
-                # Show price calculation objective if available
-                if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                    st.markdown(f"**Price Calculation:** Price per {entry['price_calc_objective']}")
-
-                st.markdown(f"**Results:** {len(entry['results'])} products found")
-
-                # Display results again
-                for j, product in enumerate(entry['results']):
-                    # Basic product info
-                    product_info = f"**{j + 1}. {product.get('product_name', 'Unknown Product')}** - €{product.get('product_price', 'N/A')}"
-
-                    # Add price calculation if available
-                    if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                        price_per_key = f"price_per_{entry['price_calc_objective']}"
-                        if price_per_key in product:
-                            unit_display = ""
-                            if entry["price_calc_objective"] == "unit" and "unit_type" in product:
-                                unit_display = f"/{product['unit_type']}"
-                            elif entry["price_calc_objective"] == "kg":
-                                unit_display = "/kg"
-                            elif entry["price_calc_objective"] == "liter":
-                                unit_display = "/L"
-                            elif entry["price_calc_objective"] == "package":
-                                unit_display = "/pkg"
-
-                            product_info += f" (€{product.get(price_per_key, 'N/A')}{unit_display})"
-
-                    st.markdown(product_info)
-                    st.markdown(
-                        f"Provider: {product.get('provider', 'N/A')} | [View Product]({product.get('provider_url', '#')})")
-
-                # Option to view full details
-                if st.button(f"View Full Details #{i}", key=f"history_{i}"):
-                    # This recreates the detailed view from the Search tab
-                    for j, product in enumerate(entry['results']):
-                        # Create product title with price calculation if available
-                        product_title = f"{j + 1}. {product.get('product_name', 'Unknown Product')} - €{product.get('product_price', 'N/A')}"
-
-                        if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                            price_per_key = f"price_per_{entry['price_calc_objective']}"
-                            if price_per_key in product:
-                                unit_display = ""
-                                if entry["price_calc_objective"] == "unit" and "unit_type" in product:
-                                    unit_display = f"/{product['unit_type']}"
-                                elif entry["price_calc_objective"] == "kg":
-                                    unit_display = "/kg"
-                                elif entry["price_calc_objective"] == "liter":
-                                    unit_display = "/L"
-                                elif entry["price_calc_objective"] == "package":
-                                    unit_display = "/pkg"
-
-                                product_title += f" (€{product.get(price_per_key, 'N/A')}{unit_display})"
-
-                        with st.expander(product_title):
-                            col1, col2 = st.columns([1, 2])
-
-                            with col1:
-                                st.markdown(f"**Provider:** {product.get('provider', 'N/A')}")
-                                st.markdown(f"**Website:** {product.get('provider_website', 'N/A')}")
-                                if 'provider_url' in product and product['provider_url']:
-                                    st.markdown(f"**Product Link:** [View Product]({product['provider_url']})")
-                                st.markdown(f"**SKU/ID:** {product.get('product_sku', 'N/A')}")
-                                st.markdown(f"**Price:** €{product.get('product_price', 'N/A')}")
-
-                                # Display price calculation if available
-                                if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                                    price_per_key = f"price_per_{entry['price_calc_objective']}"
-                                    if price_per_key in product:
-                                        unit_display = ""
-                                        if entry["price_calc_objective"] == "unit" and "unit_type" in product:
-                                            unit_display = f"/{product['unit_type']}"
-                                        elif entry["price_calc_objective"] == "kg":
-                                            unit_display = "/kg"
-                                        elif entry["price_calc_objective"] == "liter":
-                                            unit_display = "/L"
-                                        elif entry["price_calc_objective"] == "package":
-                                            unit_display = "/pkg"
-
-                                        st.markdown(
-                                            f"**Price per {entry['price_calc_objective'].capitalize()}:** €{product.get(price_per_key, 'N/A')}{unit_display}")
-
-                            with col2:
-                                st.subheader("Product Properties")
-                                properties = product.get('product_properties', {})
-                                if properties:
-                                    for key, value in properties.items():
-                                        st.markdown(f"**{key}:** {value}")
-                                else:
-                                    st.write("No detailed properties available.")
-
-                                st.subheader("Technical Evaluation")
-                                evaluation = product.get('evaluation', 'No evaluation available.')
-                                st.write(evaluation)
+    render_history(history_owner)
 
 with tab3:
     st.header("About This Application")
 
-    st.markdown("""
+    st.markdown(f"""
     ## Lithuanian Market Product Analyzer
 
     This application helps you find and compare products available in the Lithuanian market
@@ -664,9 +1058,9 @@ with tab3:
     ### How to Use
 
     1. Enter the product category or group (e.g., Smartphones, Vitamins, Sports equipment)
-    2. Enter the technical specifications for the product you're looking for
-    3. The app will automatically discover relevant Lithuanian websites for your product category
-    4. Customize search domains if needed
+    2. The app will automatically discover relevant Lithuanian websites for your product category
+    3. Customize search domains if needed
+    4. Enter the technical specifications for the product you're looking for
     5. Select a price calculation objective if you want to compare prices on a specific basis
     6. Click "Search Products"
     7. Review the results, which show:
@@ -699,14 +1093,14 @@ with tab3:
     ### Privacy Note
 
     Your search queries and technical specifications are sent to the OpenAI API
-    to generate results. No personal information is stored or shared beyond what is 
-    necessary for the application to function.
+    to generate results. Search history is kept in a local SQLite database
+    (`search_history.db`) on the machine running the application. Each browser
+    only sees its own history, identified by the `history_id` in the page URL;
+    anyone you share that URL with can see your history too. The most recent
+    {HISTORY_MAX_SEARCHES} searches per browser are kept. No personal information
+    is stored or shared beyond what is necessary for the application to function.
     """)
 
-# Update the secrets example file to include OpenAI instead of Perplexity
-with open('.streamlit/secrets-example.toml', 'w') as f:
-    f.write('[config]\nopenai_api_key = "my_key"')
-
 # Footer
 st.markdown("---")
 st.markdown("© 2025 Lithuanian Market Product Analyzer | Powered by OpenAI API")
\ No newline at end of file